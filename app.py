@@ -3,10 +3,11 @@ import time
 import math
 import asyncio
 import threading
-from typing import List, Optional, Set
+from collections import deque
+from typing import Deque, Optional, Set
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse
 
 # -----------------------------
 # GPIO / Geiger configuration
@@ -36,80 +37,81 @@ class GeigerState:
 
     def reset(self):
         with getattr(self, "lock", threading.Lock()):
-            self.t0 = time.time()
+            self.t0 = time.monotonic_ns()
             self.total = 0
-            self.last_ts: Optional[float] = None
-            self.timestamps: List[float] = []  # tiempos absolutos de pulsos
-            self.deltas: List[float] = []      # Δt en segundos
-            self.per_second: List[int] = []    # conteos integrados por segundo
+            self.last_ts: Optional[int] = None  # ns, reloj monotónico
+            # buffers circulares: al llenarse descartan lo más antiguo sin copiar
+            self.deltas: Deque[int] = deque(maxlen=MAX_DELTAS)    # Δt en ns
+            self.per_second: Deque[int] = deque(maxlen=MAX_SERIES)  # conteos integrados por segundo
+            self._running_mean: Deque[float] = deque(maxlen=MAX_SERIES)
+            self._cum_sum = 0
             self._current_second_count = 0
+            self._cached_snapshot = self._build_snapshot()
 
-    def on_pulse(self, ts: float):
+    def on_pulse(self, ts: int):
+        """`ts` en ns de time.monotonic_ns(): nunca retrocede, Δt siempre >= 0."""
         with self.lock:
             self.total += 1
             if self.last_ts is not None:
-                dt = ts - self.last_ts
-                if dt >= 0:
-                    self.deltas.append(dt)
-                    if len(self.deltas) > MAX_DELTAS:
-                        self.deltas = self.deltas[-MAX_DELTAS:]
+                self.deltas.append(ts - self.last_ts)
             self.last_ts = ts
-            self.timestamps.append(ts)
-            # recorta timestamps si crece mucho
-            if len(self.timestamps) > MAX_DELTAS * 2:
-                self.timestamps = self.timestamps[-MAX_DELTAS * 2:]
-
             self._current_second_count += 1
 
     def tick_second(self):
         """Llamar cada 1s para cerrar el bin actual."""
         with self.lock:
-            self.per_second.append(self._current_second_count)
+            c = self._current_second_count
+            # deque(maxlen) descarta el bin más antiguo en silencio: lo restamos antes
+            if len(self.per_second) == self.per_second.maxlen:
+                self._cum_sum -= self.per_second[0]
+            self.per_second.append(c)
+            self._cum_sum += c
+            self._running_mean.append(self._cum_sum / len(self.per_second))
             self._current_second_count = 0
-            if len(self.per_second) > MAX_SERIES:
-                self.per_second = self.per_second[-MAX_SERIES:]
+            # Se calcula una vez por segundo y se comparte con todos los clientes
+            self._cached_snapshot = self._build_snapshot()
 
     def snapshot(self):
-        with self.lock:
-            now = time.time()
-            elapsed = max(0.0, now - self.t0)
-            seconds = int(elapsed)
-
-            series = list(self.per_second)
-            # Ojo: el bin actual aún no cerrado no se incluye (es deseado)
-            n_bins = len(series)
-
-            # Estimación de tasa media (actividad efectiva observada)
-            # Usamos total/elapsed; error Poisson ~ sqrt(N)/T
-            if elapsed > 0:
-                rate = self.total / elapsed
-                err = math.sqrt(self.total) / elapsed if self.total > 0 else 0.0
-            else:
-                rate, err = 0.0, 0.0
-
-            # Media acumulada por segundo para dibujar en cliente
-            # (podemos enviar solo rate global y el cliente calcula running mean,
-            #  pero enviamos también un vector opcional para comodidad)
-            running_mean = []
-            s = 0
-            for i, c in enumerate(series, start=1):
-                s += c
-                running_mean.append(s / i)
-
-            # Edad del último pulso
-            last_age = (now - self.last_ts) if self.last_ts else None
-
-            return {
-                "total": self.total,
-                "elapsed": elapsed,
-                "seconds": seconds,
-                "last_age": last_age,
-                "per_second": series,
-                "running_mean": running_mean,
-                "rate_bq": rate,   # "actividad efectiva observada"
-                "rate_err": err,
-                "deltas": list(self.deltas),
-            }
+        """Snapshot del último tick (o del reset). Compartido: no modificarlo."""
+        return self._cached_snapshot
+
+    def _build_snapshot(self):
+        """Requiere self.lock."""
+        now = time.monotonic_ns()
+        elapsed = (now - self.t0) * 1e-9
+        seconds = int(elapsed)
+
+        # Ojo: el bin actual aún no cerrado no se incluye (es deseado)
+        series = list(self.per_second)
+
+        # Estimación de tasa media (actividad efectiva observada)
+        # Usamos total/elapsed; error Poisson ~ sqrt(N)/T
+        if elapsed > 0:
+            rate = self.total / elapsed
+            err = math.sqrt(self.total) / elapsed if self.total > 0 else 0.0
+        else:
+            rate, err = 0.0, 0.0
+
+        # Media acumulada por segundo para dibujar en cliente
+        # (podemos enviar solo rate global y el cliente calcula running mean,
+        #  pero enviamos también un vector opcional para comodidad).
+        # Se mantiene incrementalmente en tick_second.
+        running_mean = list(self._running_mean)
+
+        # Edad del último pulso
+        last_age = (now - self.last_ts) * 1e-9 if self.last_ts is not None else None
+
+        return {
+            "total": self.total,
+            "elapsed": elapsed,
+            "seconds": seconds,
+            "last_age": last_age,
+            "per_second": series,
+            "running_mean": running_mean,
+            "rate_bq": rate,   # "actividad efectiva observada"
+            "rate_err": err,
+            "deltas": [d * 1e-9 for d in self.deltas],  # en segundos
+        }
 
 
 state = GeigerState()
@@ -172,7 +174,7 @@ def start_geiger_reader():
                 lam = max(0.0001, MOCK_RATE)
                 dt = random.expovariate(lam)
                 time.sleep(dt)
-                ts = time.time()
+                ts = time.monotonic_ns()
                 state.on_pulse(ts)
                 schedule_broadcast({"type": "pulse", "ts": ts})
         t = threading.Thread(target=mock_thread, daemon=True)
@@ -187,7 +189,7 @@ def start_geiger_reader():
         dev = DigitalInputDevice(PIN, pull_up=PULL_UP, pin_factory=factory)
 
         def _pulse():
-            ts = time.time()
+            ts = time.monotonic_ns()
             state.on_pulse(ts)
             schedule_broadcast({"type": "pulse", "ts": ts})
 
@@ -212,7 +214,7 @@ def start_geiger_reader():
                 lam = max(0.0001, MOCK_RATE)
                 dt = random.expovariate(lam)
                 time.sleep(dt)
-                ts = time.time()
+                ts = time.monotonic_ns()
                 state.on_pulse(ts)
                 schedule_broadcast({"type": "pulse", "ts": ts})
         t = threading.Thread(target=mock_thread, daemon=True)
@@ -223,547 +225,13 @@ def start_geiger_reader():
 # -----------------------------
 app = FastAPI(title="Geiger Live")
 
-HTML = r"""
-<!doctype html>
-<html lang="es">
-<head>
-  <meta charset="utf-8" />
-  <meta name="viewport" content="width=device-width, initial-scale=1" />
-  <title>Geiger Live</title>
-
-  <!-- Chart.js desde CDN -->
-  <script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js"></script>
-
-  <style>
-    :root{
-      --bg0: #070b14;
-      --bg1: #0b1224;
-      --glow: #39ffcc;
-      --accent: #ff3df2;
-      --accent2: #7c5cff;
-      --warn: #ffb020;
-      --text: #e8f1ff;
-      --muted: #9db0d1;
-      --panel: rgba(255,255,255,0.04);
-      --panel-border: rgba(255,255,255,0.08);
-      --ok: #4dff7a;
-    }
-
-    *{box-sizing:border-box}
-    body{
-      margin:0;
-      font-family: system-ui, -apple-system, Segoe UI, Roboto, Ubuntu, Cantarell, "Helvetica Neue", Arial, "Noto Sans", sans-serif;
-      color: var(--text);
-      background:
-        radial-gradient(1200px 600px at 10% 10%, rgba(124,92,255,0.12), transparent 60%),
-        radial-gradient(1000px 800px at 90% 20%, rgba(255,61,242,0.10), transparent 55%),
-        radial-gradient(900px 700px at 50% 90%, rgba(57,255,204,0.10), transparent 60%),
-        linear-gradient(180deg, var(--bg0), var(--bg1));
-      min-height:100vh;
-      display:flex;
-      justify-content:center;
-      padding: 32px 16px 64px;
-    }
-
-    .col{
-      width:min(960px, 100%);
-      display:flex;
-      flex-direction:column;
-      gap: 18px;
-    }
-
-    .hero{
-      display:flex;
-      align-items:center;
-      justify-content:space-between;
-      gap: 12px;
-      padding: 18px 22px;
-      border: 1px solid var(--panel-border);
-      background: linear-gradient(135deg, rgba(57,255,204,0.08), rgba(255,61,242,0.06), rgba(124,92,255,0.08));
-      border-radius: 16px;
-      position:relative;
-      overflow:hidden;
-    }
-
-    .hero::after{
-      content:"";
-      position:absolute;
-      inset:-40%;
-      background: conic-gradient(from 0deg, transparent, rgba(57,255,204,0.08), transparent, rgba(255,61,242,0.08), transparent);
-      animation: spin 18s linear infinite;
-      filter: blur(18px);
-      pointer-events:none;
-    }
-
-    @keyframes spin { to { transform: rotate(360deg); } }
-
-    .title{
-      display:flex;
-      align-items:center;
-      gap: 14px;
-      z-index:1;
-    }
-
-    .rad{
-      font-size: 34px;
-      line-height:1;
-      padding: 10px 12px;
-      border-radius: 12px;
-      background: rgba(255,176,32,0.12);
-      border: 1px solid rgba(255,176,32,0.35);
-      text-shadow: 0 0 14px rgba(255,176,32,0.45);
-    }
-
-    h1{
-      font-size: clamp(22px, 3.2vw, 30px);
-      margin:0;
-      letter-spacing: 0.6px;
-    }
-
-    .subtitle{
-      margin: 2px 0 0;
-      color: var(--muted);
-      font-size: 13px;
-    }
-
-    .controls{
-      display:flex;
-      align-items:center;
-      gap: 10px;
-      z-index:1;
-      flex-wrap:wrap;
-    }
-
-    .btn{
-      border: 1px solid var(--panel-border);
-      background: var(--panel);
-      color: var(--text);
-      padding: 10px 14px;
-      border-radius: 12px;
-      cursor:pointer;
-      font-weight: 600;
-      letter-spacing: 0.2px;
-      transition: 120ms ease;
-    }
-    .btn:hover{ transform: translateY(-1px); border-color: rgba(255,255,255,0.18); }
-    .btn:active{ transform: translateY(0px) scale(0.99); }
-
-    .btn-reset{
-      background:
-        linear-gradient(135deg, rgba(255,61,242,0.18), rgba(124,92,255,0.18));
-      border-color: rgba(255,61,242,0.35);
-      box-shadow: inset 0 0 0 1px rgba(255,255,255,0.03);
-    }
-
-    .toggle{
-      display:flex;
-      align-items:center;
-      gap: 8px;
-      padding: 8px 10px;
-      border-radius: 10px;
-      border: 1px solid var(--panel-border);
-      background: var(--panel);
-      font-size: 12px;
-      color: var(--muted);
-    }
-    .toggle input{ transform: translateY(1px); }
-
-    .panel{
-      border: 1px solid var(--panel-border);
-      background: var(--panel);
-      border-radius: 16px;
-      padding: 16px 18px 14px;
-    }
-
-    .panel h2{
-      margin: 0 0 10px;
-      font-size: 16px;
-      color: #f7fbff;
-      letter-spacing: 0.4px;
-    }
-
-    .metrics{
-      display:grid;
-      grid-template-columns: repeat(3, minmax(0,1fr));
-      gap: 10px;
-    }
-    @media (max-width: 720px){
-      .metrics{ grid-template-columns: 1fr; }
-      .hero{ flex-direction:column; align-items:flex-start; }
-    }
-
-    .metric{
-      padding: 14px 14px 12px;
-      border-radius: 14px;
-      border: 1px solid var(--panel-border);
-      background:
-        linear-gradient(180deg, rgba(255,255,255,0.02), rgba(255,255,255,0.00));
-      position:relative;
-      overflow:hidden;
-    }
-
-    .metric .label{
-      font-size: 11px;
-      color: var(--muted);
-      letter-spacing: 0.3px;
-    }
-    .metric .value{
-      font-size: clamp(22px, 3.4vw, 30px);
-      font-weight: 800;
-      margin-top: 2px;
-      display:flex;
-      align-items:baseline;
-      gap: 8px;
-    }
-    .unit{
-      font-size: 11px;
-      color: var(--muted);
-      font-weight: 600;
-    }
-
-    .blink-dot{
-      width: 10px; height: 10px;
-      border-radius: 999px;
-      background: rgba(57,255,204,0.25);
-      border: 1px solid rgba(57,255,204,0.3);
-      box-shadow: 0 0 0 0 rgba(57,255,204,0.0);
-      transition: 80ms ease;
-      margin-left: 6px;
-    }
-    .blink-dot.active{
-      background: var(--glow);
-      box-shadow:
-        0 0 10px rgba(57,255,204,0.9),
-        0 0 24px rgba(57,255,204,0.55);
-      transform: scale(1.25);
-    }
-
-    .small{
-      font-size: 11px;
-      color: var(--muted);
-      margin-top: 6px;
-    }
-
-    .chart-wrap{
-      height: 260px;
-    }
-    canvas{
-      width: 100% !important;
-      height: 100% !important;
-    }
-
-    .caption{
-      display:flex;
-      align-items:center;
-      gap: 10px;
-      margin-top: 10px;
-      padding: 10px 12px;
-      border-radius: 12px;
-      border: 1px solid rgba(57,255,204,0.22);
-      background: rgba(57,255,204,0.06);
-      font-size: 12px;
-      color: #eafff9;
-    }
-    .caption b{
-      color: white;
-      font-weight: 800;
-    }
-
-    .foot{
-      color: var(--muted);
-      font-size: 11px;
-      padding: 6px 4px 0;
-      text-align:center;
-    }
-  </style>
-</head>
-
-<body>
-  <div class="col">
-
-    <div class="hero">
-      <div class="title">
-        <div class="rad">☢</div>
-        <div>
-          <h1>Geiger Live Lab</h1>
-          <div class="subtitle">Conteo en vivo · Serie temporal · Histograma de Δt</div>
-        </div>
-      </div>
-
-      <div class="controls">
-        <button class="btn btn-reset" id="resetBtn">RESET GENERAL</button>
-        <label class="toggle">
-          <input type="checkbox" id="soundToggle" />
-          Sonido “pi!”
-        </label>
-      </div>
-    </div>
-
-    <div class="panel">
-      <h2>1) Modo Conteo</h2>
-      <div class="metrics">
-        <div class="metric">
-          <div class="label">Conteo total desde el último reset</div>
-          <div class="value">
-            <span id="totalCount">0</span>
-            <span class="blink-dot" id="blinkDot"></span>
-          </div>
-          <div class="small">Parpadea en cada detección</div>
-        </div>
-
-        <div class="metric">
-          <div class="label">Segundos desde el último reset</div>
-          <div class="value">
-            <span id="elapsedSec">0</span>
-            <span class="unit">s</span>
-          </div>
-          <div class="small">Cronómetro interno de la sesión</div>
-        </div>
-
-        <div class="metric">
-          <div class="label">Tiempo desde el último pulso</div>
-          <div class="value">
-            <span id="lastAge">—</span>
-            <span class="unit">s</span>
-          </div>
-          <div class="small">Útil para ver si “hay vida” en el flujo</div>
-        </div>
-      </div>
-    </div>
-
-    <div class="panel">
-      <h2>2) Plot temporal (integrado por segundo)</h2>
-      <div class="chart-wrap">
-        <canvas id="timeChart"></canvas>
-      </div>
-      <div class="caption" id="activityCaption">
-        Actividad efectiva observada: <b>0.00</b> ± <b>0.00</b> Bq
-      </div>
-      <div class="small">
-        Se dibuja el conteo por segundo y la media acumulada. Estimación simple con error Poisson.
-      </div>
-    </div>
-
-    <div class="panel">
-      <h2>3) Histograma de Δt</h2>
-      <div class="chart-wrap">
-        <canvas id="dtChart"></canvas>
-      </div>
-      <div class="small">
-        Δt entre detecciones sucesivas. Para un proceso de Poisson ideal debería aproximar una exponencial.
-      </div>
-    </div>
-
-    <div class="foot">
-      Consejo: si tu salida es open-collector activa a GND, ejecuta con GEIGER_PULL_UP=1.
-    </div>
-
-  </div>
-
-<script>
-  // ---------------------------
-  // Audio "pi!"
-  // ---------------------------
-  let audioCtx = null;
-
-  function beep(){
-    const enabled = document.getElementById("soundToggle").checked;
-    if(!enabled) return;
-
-    if(!audioCtx){
-      audioCtx = new (window.AudioContext || window.webkitAudioContext)();
-    }
-
-    const o = audioCtx.createOscillator();
-    const g = audioCtx.createGain();
-
-    o.type = "sine";
-    o.frequency.value = 1200;
-
-    g.gain.setValueAtTime(0.0001, audioCtx.currentTime);
-    g.gain.exponentialRampToValueAtTime(0.08, audioCtx.currentTime + 0.01);
-    g.gain.exponentialRampToValueAtTime(0.0001, audioCtx.currentTime + 0.08);
-
-    o.connect(g).connect(audioCtx.destination);
-    o.start();
-    o.stop(audioCtx.currentTime + 0.09);
-  }
-
-  // ---------------------------
-  // Blink
-  // ---------------------------
-  function blink(){
-    const dot = document.getElementById("blinkDot");
-    dot.classList.add("active");
-    setTimeout(()=>dot.classList.remove("active"), 90);
-  }
-
-  // ---------------------------
-  // Charts
-  // ---------------------------
-  const timeCtx = document.getElementById("timeChart");
-  const dtCtx = document.getElementById("dtChart");
-
-  const timeChart = new Chart(timeCtx, {
-    type: "line",
-    data: {
-      labels: [],
-      datasets: [
-        { label: "Cuentas por segundo", data: [], tension: 0.25 },
-        { label: "Media acumulada", data: [], tension: 0.25 }
-      ]
-    },
-    options: {
-      responsive: true,
-      animation: false,
-      scales: {
-        x: { ticks: { maxTicksLimit: 8 } },
-        y: { beginAtZero: true }
-      },
-      plugins: {
-        legend: { display: true }
-      }
-    }
-  });
-
-  const dtChart = new Chart(dtCtx, {
-    type: "bar",
-    data: {
-      labels: [],
-      datasets: [
-        { label: "Frecuencia", data: [] }
-      ]
-    },
-    options: {
-      responsive: true,
-      animation: false,
-      scales: {
-        x: { ticks: { maxTicksLimit: 10 } },
-        y: { beginAtZero: true }
-      },
-      plugins: {
-        legend: { display: true }
-      }
-    }
-  });
-
-  function updateTimeChart(perSecond, runningMean){
-    const n = perSecond.length;
-    const labels = Array.from({length:n}, (_, i)=> i+1);
-
-    timeChart.data.labels = labels;
-    timeChart.data.datasets[0].data = perSecond;
-    timeChart.data.datasets[1].data = runningMean;
-    timeChart.update();
-  }
-
-  function updateDtHistogram(deltas){
-    if(!deltas || deltas.length < 2){
-      dtChart.data.labels = [];
-      dtChart.data.datasets[0].data = [];
-      dtChart.update();
-      return;
-    }
-
-    // Bins adaptativos simples
-    const maxDt = Math.max(...deltas);
-    const minDt = Math.min(...deltas);
-
-    // Limitar rango visual para que no se estropee con outliers enormes
-    const cap = Math.max(1.5, Math.min(10.0, maxDt));
-    const filtered = deltas.filter(d => d >= 0 && d <= cap);
-
-    const bins = 24;
-    const lo = 0.0;
-    const hi = cap;
-    const w = (hi - lo) / bins;
-
-    const counts = new Array(bins).fill(0);
-    for(const d of filtered){
-      let idx = Math.floor((d - lo) / w);
-      if(idx < 0) idx = 0;
-      if(idx >= bins) idx = bins - 1;
-      counts[idx] += 1;
-    }
-
-    const labels = counts.map((_, i)=>{
-      const a = (lo + i*w).toFixed(2);
-      const b = (lo + (i+1)*w).toFixed(2);
-      return `${a}-${b}s`;
-    });
-
-    dtChart.data.labels = labels;
-    dtChart.data.datasets[0].data = counts;
-    dtChart.update();
-  }
-
-  function updateCaption(rate, err){
-    const cap = document.getElementById("activityCaption");
-    const r = (rate ?? 0).toFixed(2);
-    const e = (err ?? 0).toFixed(2);
-    cap.innerHTML = `Actividad efectiva observada: <b>${r}</b> ± <b>${e}</b> Bq`;
-  }
-
-  // ---------------------------
-  // Reset
-  // ---------------------------
-  document.getElementById("resetBtn").addEventListener("click", async ()=>{
-    await fetch("/api/reset", { method: "POST" });
-  });
-
-  // ---------------------------
-  // WebSocket
-  // ---------------------------
-  const wsProto = location.protocol === "https:" ? "wss" : "ws";
-  const ws = new WebSocket(`${wsProto}://${location.host}/ws`);
-
-  ws.onmessage = (ev)=>{
-    const msg = JSON.parse(ev.data);
-
-    if(msg.type === "pulse"){
-      // feedback inmediato
-      blink();
-      beep();
-      return;
-    }
-
-    if(msg.type === "snapshot"){
-      document.getElementById("totalCount").textContent = msg.total ?? 0;
-      document.getElementById("elapsedSec").textContent = Math.floor(msg.elapsed ?? 0);
-
-      if(msg.last_age == null){
-        document.getElementById("lastAge").textContent = "—";
-      }else{
-        document.getElementById("lastAge").textContent = (msg.last_age).toFixed(2);
-      }
-
-      updateTimeChart(msg.per_second ?? [], msg.running_mean ?? []);
-      updateDtHistogram(msg.deltas ?? []);
-      updateCaption(msg.rate_bq ?? 0, msg.rate_err ?? 0);
-    }
-
-    if(msg.type === "reset_ack"){
-      // reseteo visual inmediato
-      document.getElementById("totalCount").textContent = 0;
-      document.getElementById("elapsedSec").textContent = 0;
-      document.getElementById("lastAge").textContent = "—";
-      updateTimeChart([], []);
-      updateDtHistogram([]);
-      updateCaption(0,0);
-    }
-  };
-
-  ws.onopen = ()=>console.log("WS conectado");
-  ws.onclose = ()=>console.log("WS cerrado");
-</script>
-
-</body>
-</html>
-"""
+# Página propia de app.py, fuera de static/ (que main.py publica en /static)
+INDEX_HTML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_static", "index.html")
 
 @app.get("/")
 def index():
-    return HTMLResponse(HTML)
+    # FileResponse usa sendfile() y el navegador puede cachear la página
+    return FileResponse(INDEX_HTML, headers={"Cache-Control": "public, max-age=3600"})
 
 @app.post("/api/reset")
 def api_reset():
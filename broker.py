@@ -0,0 +1,217 @@
+"""
+Difusión entre varios workers de Uvicorn con Redis pub/sub (opcional).
+
+El GPIO solo lo puede abrir un proceso: el worker que consigue el lock de
+fichero es el "dueño", lee los pulsos y calcula los ticks. Cada mensaje ya
+serializado lo reparte directamente a sus clientes y lo publica en Redis;
+los demás workers lo reparten a los suyos, así el envío a muchos clientes
+se reparte entre varios núcleos. Si Redis cae, los clientes del dueño siguen
+recibiendo datos.
+
+El snapshot completo no se guarda en cada tick: un worker que lo necesita lo
+pide por CONTROL y el dueño lo publica en SNAPSHOT. Como sale por el mismo
+publicador que los ticks, llega en orden con ellos y el cliente nuevo no
+pierde ni repite ningún tick. Si se pierden mensajes (cola de publicación
+llena o suscripción caída), todos los clientes de los demás workers reciben
+otra vez el snapshot completo.
+"""
+import asyncio
+import fcntl
+import os
+from typing import Callable, List, Optional
+
+CHANNEL = "geiger:ws"            # mensajes para los clientes WS
+CONTROL = "geiger:control"       # órdenes para el dueño: b"reset", b"snapshot"
+SNAPSHOT = "geiger:snapshot"     # respuestas del dueño a b"snapshot"
+
+_owner_fd: Optional[int] = None
+
+
+def acquire_owner_lock(path: str) -> bool:
+    """
+    Intenta quedarse el lock del GPIO. El descriptor queda abierto toda la
+    vida del proceso: el kernel libera el lock si el worker muere.
+    """
+    global _owner_fd
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    _owner_fd = fd
+    return True
+
+
+class RedisBus:
+    """
+    Publica y recibe mensajes serializados. Todos los métodos se llaman desde
+    el hilo del loop; publish() no espera: encola y un único publicador los
+    envía en orden.
+    """
+
+    # Operaciones pendientes de enviar a Redis; si Redis va lento o no está,
+    # las nuevas se descartan en vez de acumularse en memoria
+    QUEUE_SIZE = 256
+    # Espera entre reintentos de suscripción (s), doblándose hasta el máximo
+    RETRY_MIN = 1.0
+    RETRY_MAX = 30.0
+    # Con una petición de snapshot sin responder, como mucho otra por este
+    # intervalo (s); las que llegan entretanto esperan a la misma respuesta
+    SNAPSHOT_REQUEST_INTERVAL = 0.5
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        # PING periódico en la suscripción: detecta conexiones medio caídas
+        self.redis = redis.from_url(url, health_check_interval=10)
+        self._out: asyncio.Queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        self._dropping = False
+        self._tasks = []
+        # True mientras la suscripción está activa; si no, el dueño no
+        # intenta publicar
+        self.up = False
+        # Quien espera el próximo snapshot del dueño (solo en los demás workers)
+        self._snapshot_waiters: List[Callable[[bytes], None]] = []
+        self._snapshot_requested = float("-inf")
+        self._on_message: Optional[Callable[[bytes], None]] = None
+        self._make_snapshot: Optional[Callable[[], bytes]] = None
+
+    def start(self, on_message: Optional[Callable[[bytes], None]] = None,
+              on_control: Optional[Callable[[bytes], None]] = None,
+              snapshot: Optional[Callable[[], bytes]] = None):
+        """
+        `on_message` en los demás workers (mensajes para sus clientes);
+        `on_control` y `snapshot` (construye el snapshot actual) en el dueño.
+        """
+        self._on_message = on_message
+        self._make_snapshot = snapshot
+        self._tasks = [
+            asyncio.create_task(self._publisher()),
+            asyncio.create_task(self._listen(on_message, on_control)),
+        ]
+
+    def _put(self, op: tuple):
+        try:
+            self._out.put_nowait(op)
+        except asyncio.QueueFull:
+            if not self._dropping:
+                print("[BUS] redis backlog full, dropping messages")
+            self._dropping = True
+        else:
+            if self._dropping:
+                self._dropping = False
+                self._resync()
+
+    def _resync(self):
+        """
+        Tras perder mensajes (cola llena o suscripción caída), los clientes
+        de los demás workers reciben de nuevo el snapshot completo.
+        """
+        if self._make_snapshot is not None:
+            # Dueño: por CHANNEL, para los clientes de todos los demás workers
+            self._put((CHANNEL, self._make_snapshot()))
+        elif self._on_message is not None:
+            # Resto: se pide al dueño y se reparte a todos los clientes locales
+            if self._on_message not in self._snapshot_waiters:
+                self._snapshot_waiters.append(self._on_message)
+            self._request_snapshot(force=True)
+
+    def publish(self, data: bytes):
+        self._put((CHANNEL, data))
+
+    def publish_snapshot(self, data: bytes):
+        """El dueño responde a una petición de snapshot."""
+        self._put((SNAPSHOT, data))
+
+    def request_reset(self):
+        self._put((CONTROL, b"reset"))
+
+    def on_next_snapshot(self, callback: Callable[[bytes], None]):
+        """
+        Llama a `callback(data)` con el próximo snapshot del dueño, desde el
+        listener y antes de procesar el siguiente mensaje de CHANNEL.
+        """
+        pending = bool(self._snapshot_waiters)
+        self._snapshot_waiters.append(callback)
+        self._request_snapshot(force=not pending)
+
+    def _request_snapshot(self, force: bool = False):
+        now = asyncio.get_running_loop().time()
+        if force or now - self._snapshot_requested >= self.SNAPSHOT_REQUEST_INTERVAL:
+            self._snapshot_requested = now
+            self._put((CONTROL, b"snapshot"))
+
+    async def snapshot(self, timeout: float = 3.0) -> Optional[bytes]:
+        """Próximo snapshot del dueño, o None si no responde a tiempo."""
+        future = asyncio.get_running_loop().create_future()
+
+        def done(data: bytes):
+            if not future.done():
+                future.set_result(data)
+
+        self.on_next_snapshot(done)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _publisher(self):
+        r = self.redis
+        failing = False
+        while True:
+            channel, data = await self._out.get()
+            try:
+                await r.publish(channel, data)
+            except Exception as e:
+                # Un aviso por caída, no uno por mensaje
+                if not failing:
+                    print(f"[BUS] publish failed: {e}")
+                failing = True
+            else:
+                failing = False
+
+    async def _listen(self, on_message, on_control):
+        """Suscripción con reintentos: una caída de Redis no la mata para siempre."""
+        channels = [CHANNEL, SNAPSHOT] if on_message else []
+        if on_control:
+            channels.append(CONTROL)
+        delay = self.RETRY_MIN
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(*channels)
+                self.up = True
+                delay = self.RETRY_MIN
+                # Lo publicado mientras no había suscripción se ha perdido (y
+                # una petición de snapshot pendiente pudo irse con la conexión)
+                self._resync()
+                async for msg in pubsub.listen():
+                    if msg["type"] != "message":
+                        continue
+                    channel = msg["channel"]
+                    if channel == CHANNEL.encode():
+                        on_message(msg["data"])
+                    elif channel == SNAPSHOT.encode():
+                        waiters, self._snapshot_waiters = self._snapshot_waiters, []
+                        for callback in waiters:
+                            callback(msg["data"])
+                    else:
+                        on_control(msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[BUS] redis subscription lost: {e}; retrying in {delay:g} s")
+            finally:
+                self.up = False
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.RETRY_MAX)
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await self.redis.aclose()
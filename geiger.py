@@ -1,12 +1,12 @@
 import os
 import time
 import math
+import array
 import threading
 from dataclasses import dataclass
-from typing import Callable, Optional, List
+from typing import Callable, Optional
 
-# RPi.GPIO es el backend real porque YA te funciona
-import RPi.GPIO as GPIO
+import numpy as np
 
 
 @dataclass
@@ -15,8 +15,11 @@ class GeigerConfig:
     verbose: bool = False
     mock: bool = False
     mock_rate: float = 5.0
+    backend: str = "rpigpio"  # "rpigpio" | "pigpio" | "gpiod"
+    gpiochip: str = "/dev/gpiochip0"
     max_deltas: int = 2000
     max_series: int = 3600
+    pulse_window_ms: float = 33.0
 
     @classmethod
     def from_env(cls) -> "GeigerConfig":
@@ -25,99 +28,297 @@ class GeigerConfig:
             verbose=os.getenv("GEIGER_VERBOSE", "0") == "1",
             mock=os.getenv("GEIGER_MOCK", "0") == "1",
             mock_rate=float(os.getenv("GEIGER_MOCK_RATE", "5.0")),
+            backend=os.getenv("GEIGER_BACKEND", "rpigpio").lower(),
+            gpiochip=os.getenv("GEIGER_GPIOCHIP", "/dev/gpiochip0"),
             max_deltas=int(os.getenv("GEIGER_MAX_DELTAS", "2000")),
             max_series=int(os.getenv("GEIGER_MAX_SERIES", "3600")),
+            pulse_window_ms=float(os.getenv("GEIGER_PULSE_WINDOW_MS", "33")),
         )
 
 
+def _poisson_rate(total: int, elapsed: float):
+    """Tasa media total/T con error Poisson sqrt(N)/T."""
+    if elapsed > 0:
+        rate = total / elapsed
+        err = math.sqrt(total) / elapsed if total > 0 else 0.0
+    else:
+        rate, err = 0.0, 0.0
+    return rate, err
+
+
+def _dt_histogram(deltas_ns: np.ndarray, bins: int = 24) -> dict:
+    """
+    Histograma de Δt (s) entre 0 y un tope adaptativo en [1.5, 10] s,
+    para no estropear la escala con outliers enormes.
+    """
+    if deltas_ns.size < 2:
+        return {"edges": [], "counts": []}
+    d = deltas_ns * 1e-9
+    cap = max(1.5, min(10.0, float(d.max())))
+    counts, edges = np.histogram(d[d <= cap], bins=bins, range=(0.0, cap))
+    return {"edges": edges, "counts": counts}
+
+
+class RingBuffer:
+    """
+    Buffer circular de capacidad fija sobre array.array.
+    El almacenamiento se redondea a potencia de 2 para indexar con máscara;
+    append es O(1) y nunca realoja memoria.
+    """
+
+    def __init__(self, maxlen: int, typecode: str = "d"):
+        size = 1
+        while size < maxlen:
+            size <<= 1
+        self.maxlen = maxlen
+        self._mask = size - 1
+        self._buf = array.array(typecode, bytes(size * array.array(typecode).itemsize))
+        self._view = np.frombuffer(self._buf, dtype=typecode)  # vista sin copia
+        self._w = 0  # escrituras totales (el índice real es _w & _mask)
+
+    def append(self, x):
+        # Un único escritor: primero el dato, luego el cursor. Un lector que vea
+        # el cursor nuevo ya ve el dato (SPSC, sin lock bajo el GIL).
+        self._buf[self._w & self._mask] = x
+        self._w += 1
+
+    def extend(self, values: np.ndarray):
+        """Escritura en bloque (los datos más antiguos se descartan si no caben)."""
+        n = len(values)
+        if n > self.maxlen:
+            self._w += n - self.maxlen
+            values = values[-self.maxlen:]
+            n = self.maxlen
+        i = self._w & self._mask
+        k = min(n, len(self._view) - i)
+        self._view[i:i + k] = values[:k]
+        self._view[:n - k] = values[k:]
+        self._w += n
+
+    def __len__(self) -> int:
+        return min(self._w, self.maxlen)
+
+    @property
+    def written(self) -> int:
+        """Número total de elementos escritos desde la creación."""
+        return self._w
+
+    def span(self, start: int, end: int) -> np.ndarray:
+        """
+        Copia en orden cronológico los elementos escritos en [start, end),
+        contando en escrituras totales. Lo ya sobrescrito se omite.
+        """
+        start = max(start, self._w - self.maxlen, 0)
+        n = end - start
+        if n <= 0:
+            return self._view[:0].copy()
+        i = start & self._mask
+        j = i + n
+        if j <= len(self._view):
+            return self._view[i:j].copy()
+        return np.concatenate((self._view[i:], self._view[:j & self._mask]))
+
+    def at(self, pos: int):
+        """Elemento escrito en la posición `pos` (contando escrituras totales)."""
+        return self._buf[pos & self._mask]
+
+
 class GeigerState:
+    """
+    on_pulse lo llama un único hilo (el lector) y no toma ningún lock: solo
+    escribe el timestamp en un ring SPSC. El resto (tick, snapshot, reset)
+    se coordina con self.lock y vacía el ring en cada tick.
+    """
+
+    # Pulsos que caben entre dos ticks (1 s) antes de perder los más antiguos
+    PULSE_RING_SIZE = 1 << 16
+
     def __init__(self, cfg: GeigerConfig):
         self.cfg = cfg
         self.lock = threading.Lock()
+        self._pulses = RingBuffer(self.PULSE_RING_SIZE, "q")  # timestamps en ns
+        # on_pulse(ts) es directamente el append del ring: un frame menos por
+        # pulso. `ts` en ns de time.monotonic_ns() (nunca retrocede).
+        self.on_pulse: Callable[[int], None] = self._pulses.append
         self.reset()
 
     def reset(self):
         with self.lock:
-            self.t0 = time.time()
-            self.total = 0
-            self.last_ts: Optional[float] = None
-            self.deltas: List[float] = []
-            self.per_second: List[int] = []
-            self._current_second_count = 0
-
-    def on_pulse(self, ts: float):
-        with self.lock:
-            self.total += 1
-            if self.last_ts is not None:
-                dt = ts - self.last_ts
-                if dt >= 0:
-                    self.deltas.append(dt)
-                    if len(self.deltas) > self.cfg.max_deltas:
-                        self.deltas = self.deltas[-self.cfg.max_deltas:]
-
-            self.last_ts = ts
-            self._current_second_count += 1
-
-    def tick_second(self):
+            w = self._pulses.written
+            self.t0 = time.monotonic_ns()
+            self._base = w      # posición del ring en el último reset
+            self._read = w      # hasta dónde se han calculado los Δt
+            self._tick_at = w   # posición del ring en el último tick
+            self.last_ts: Optional[int] = None  # ns, último pulso ya procesado
+            self.deltas = RingBuffer(self.cfg.max_deltas, "q")  # Δt en ns
+            self.per_second = RingBuffer(self.cfg.max_series, "i")  # int32
+            self._running_mean = RingBuffer(self.cfg.max_series, "d")
+            self._cum_sum = 0
+            self._hist: Optional[dict] = None  # histograma de Δt; None = sucio
+            self._cached_snapshot = self._build_snapshot(w)
+
+    @property
+    def total(self) -> int:
+        return self._pulses.written - self._base
+
+    def _drain(self, w: int) -> bool:
+        """
+        Pasa los pulsos [_read, w) del ring a Δt. Requiere self.lock.
+        Devuelve si ha entrado algún pulso (el histograma queda sucio).
+        """
+        ts = self._pulses.span(self._read, w)
+        self._read = w
+        if not ts.size:
+            return False
+        self._hist = None
+        if self.last_ts is not None:
+            self.deltas.extend(np.diff(ts, prepend=self.last_ts))
+        else:
+            self.deltas.extend(np.diff(ts))
+        self.last_ts = int(ts[-1])
+        return True
+
+    def _dt_hist(self) -> dict:
+        """Histograma de Δt, recalculado solo si han entrado pulsos. Requiere self.lock."""
+        if self._hist is None:
+            self._hist = _dt_histogram(self.deltas.span(0, self.deltas.written))
+        return self._hist
+
+    def tick_second(self, publish: bool = True) -> Optional[dict]:
+        """
+        Cierra el bin del segundo actual.
+        Devuelve solo lo nuevo desde el tick anterior (para enviar por WS)
+        y deja preparado el snapshot completo que devuelve snapshot().
+        Con publish=False (nadie escuchando) solo cierra el bin: el snapshot
+        se calculará cuando alguien lo pida.
+        """
         with self.lock:
-            self.per_second.append(self._current_second_count)
-            self._current_second_count = 0
-            if len(self.per_second) > self.cfg.max_series:
-                self.per_second = self.per_second[-self.cfg.max_series:]
-
-    def snapshot(self):
-        with self.lock:
-            now = time.time()
-            elapsed = max(0.0, now - self.t0)
-
-            if elapsed > 0:
-                rate = self.total / elapsed
-                err = math.sqrt(self.total) / elapsed if self.total > 0 else 0.0
-            else:
-                rate, err = 0.0, 0.0
-
-            running_mean = []
-            s = 0
-            for i, c in enumerate(self.per_second, start=1):
-                s += c
-                running_mean.append(s / i)
-
-            last_age = (now - self.last_ts) if self.last_ts else None
-
-            return {
-                "total": self.total,
-                "elapsed": elapsed,
-                "last_age": last_age,
-                "per_second": list(self.per_second),
-                "running_mean": running_mean,
-                "rate_bq": rate,
-                "rate_err": err,
-                "deltas": list(self.deltas),
-            }
+            w = self._pulses.written
+            c = w - self._tick_at
+            self._tick_at = w
+            changed = self._drain(w)
+
+            # el ring sobrescribe el bin más antiguo: lo restamos antes
+            n = self.per_second.written
+            if n >= self.per_second.maxlen:
+                self._cum_sum -= self.per_second.at(n - self.per_second.maxlen)
+            self.per_second.append(c)
+            self._cum_sum += c
+            mean = self._cum_sum / len(self.per_second)
+            self._running_mean.append(mean)
+
+            if not publish:
+                self._cached_snapshot = None
+                return None
+            snap = self._build_snapshot(w)
+            self._cached_snapshot = snap
+
+        tick = {
+            "total": snap["total"],
+            "elapsed": snap["elapsed"],
+            "last_age": snap["last_age"],
+            "cps": c,
+            "running_mean": mean,
+            "rate_bq": snap["rate_bq"],
+            "rate_err": snap["rate_err"],
+        }
+        # Sin pulsos nuevos el histograma es el mismo: el cliente conserva
+        # el último y nos ahorramos reenviarlo
+        if changed:
+            tick["dt_hist"] = snap["dt_hist"]
+        return tick
+
+    def _build_snapshot(self, w: int) -> dict:
+        """Estado completo con los pulsos procesados hasta w. Requiere self.lock."""
+        now = time.monotonic_ns()
+        total = w - self._base
+        elapsed = (now - self.t0) * 1e-9
+        rate, err = _poisson_rate(total, elapsed)
+        last_ts = self.last_ts
+
+        return {
+            "total": total,
+            "elapsed": elapsed,
+            "last_age": (now - last_ts) * 1e-9 if last_ts is not None else None,
+            "per_second": self.per_second.span(0, self.per_second.written),
+            "running_mean": self._running_mean.span(0, self._running_mean.written),
+            "rate_bq": rate,
+            "rate_err": err,
+            "dt_hist": self._dt_hist(),
+            "max_series": self.cfg.max_series,
+        }
+
+    def snapshot(self) -> dict:
+        """
+        Último snapshot publicado (se rehace en cada tick y en cada reset).
+        Es compartido: no modificar el dict devuelto. Las series son arrays
+        de numpy (orjson.OPT_SERIALIZE_NUMPY las serializa directamente).
+        """
+        snap = self._cached_snapshot
+        if snap is None:
+            with self.lock:
+                if self._cached_snapshot is None:
+                    self._cached_snapshot = self._build_snapshot(self._tick_at)
+                snap = self._cached_snapshot
+        return snap
 
 
 class GeigerReader:
     """
     Lector de pulsos basado en RPi.GPIO edge detection.
     Este es el método que YA te funciona en geiger_print.py.
+
+    Con GEIGER_BACKEND=pigpio se usa el daemon pigpiod: detecta los flancos
+    por DMA con marca de tiempo en µs y solo entra en Python para entregar
+    cada pulso ya fechado.
+
+    Con GEIGER_BACKEND=gpiod se leen los eventos del chardev del kernel
+    (libgpiod v2): el kernel los fecha y los acumula, y un hilo los recoge
+    por lotes cada GPIOD_BATCH_S en vez de despertar a Python por pulso.
     """
 
+    # Cada cuánto recoge el hilo gpiod los eventos acumulados en el kernel
+    GPIOD_BATCH_S = 0.02
+    GPIOD_BUFFER = 1024
+    # Antirrebote de pigpio y gpiod (µs): un flanco solo cuenta si la línea
+    # se mantiene estable este tiempo. No es el bouncetime=1 ms de RPi.GPIO
+    # (que ignora flancos durante 1 ms tras uno aceptado): con 1 ms aquí se
+    # perderían los pulsos de menos de 1 ms de ancho. Basta para la
+    # oscilación de un flanco (unos pocos µs).
+    DEBOUNCE_US = 10
+
     def __init__(self, cfg: GeigerConfig):
         self.cfg = cfg
-        self._on_pulse: Optional[Callable[[float], None]] = None
+        self._on_pulse: Optional[Callable[[int], None]] = None
         self._stop = threading.Event()
         self._mock_thread: Optional[threading.Thread] = None
+        self._gpio = None
+        self._pi = None
+        self._pi_cb = None
+        self._gpiod_thread: Optional[threading.Thread] = None
         self._started = False
 
-    def set_callback(self, cb: Callable[[float], None]):
+    def set_callback(self, cb: Callable[[int], None]):
         self._on_pulse = cb
 
-    def _emit(self):
-        ts = time.time()
+    def _emit(self, ts: Optional[int] = None):
+        if ts is None:
+            ts = time.monotonic_ns()
         if self._on_pulse:
             self._on_pulse(ts)
         if self.cfg.verbose:
-            print(f"[GEIGER] pulse @ {ts:.6f}")
+            print(f"[GEIGER] pulse @ {ts * 1e-9:.6f}")
+
+    def _emitter(self) -> Callable[[int], None]:
+        """
+        Función a llamar por pulso, resuelta una vez al arrancar: sin verbose
+        es directamente el callback, sin pasar por _emit ni mirar la config.
+        """
+        if self.cfg.verbose:
+            return self._emit
+        if self._on_pulse is None:
+            return lambda ts: None
+        return self._on_pulse
 
     def start(self):
         if self._started:
@@ -128,6 +329,20 @@ class GeigerReader:
             self._start_mock()
             return
 
+        if self.cfg.backend == "pigpio":
+            self._start_pigpio()
+            return
+
+        if self.cfg.backend == "gpiod":
+            self._start_gpiod()
+            return
+
+        # RPi.GPIO es el backend real porque YA te funciona.
+        # Se importa aquí: al ser una extensión C sin soporte free-threaded,
+        # importarlo reactiva el GIL aunque se use pigpio o el modo mock.
+        import RPi.GPIO as GPIO
+        self._gpio = GPIO
+
         # Limpieza defensiva
         try:
             GPIO.cleanup()
@@ -142,11 +357,13 @@ class GeigerReader:
         except Exception:
             pass
 
+        emit = self._emitter()
+        now = time.monotonic_ns
         try:
             GPIO.add_event_detect(
                 self.cfg.pin,
                 GPIO.RISING,
-                callback=lambda ch: self._emit(),
+                callback=lambda ch: emit(now()),
                 bouncetime=1
             )
         except RuntimeError as e:
@@ -158,6 +375,22 @@ class GeigerReader:
 
     def stop(self):
         self._stop.set()
+        if self._gpiod_thread is not None:
+            # El propio hilo libera la petición de la línea al salir
+            self._gpiod_thread.join(timeout=1.0)
+            self._gpiod_thread = None
+            return
+        if self._pi is not None:
+            try:
+                self._pi_cb.cancel()
+                self._pi.stop()
+            except Exception:
+                pass
+            self._pi = None
+            return
+        GPIO = self._gpio
+        if GPIO is None:
+            return
         try:
             GPIO.remove_event_detect(self.cfg.pin)
         except Exception:
@@ -167,6 +400,91 @@ class GeigerReader:
         except Exception:
             pass
 
+    def _start_pigpio(self):
+        import pigpio
+
+        pi = pigpio.pi()
+        if not pi.connected:
+            raise RuntimeError("pigpiod is not running (sudo systemctl start pigpiod)")
+
+        pi.set_mode(self.cfg.pin, pigpio.INPUT)
+        pi.set_pull_up_down(self.cfg.pin, pigpio.PUD_DOWN)
+        # Un flanco que oscila no cuenta dos veces (como bouncetime en RPi.GPIO).
+        # El tick llega DEBOUNCE_US más tarde, igual en todos: no afecta a Δt
+        pi.set_glitch_filter(self.cfg.pin, self.DEBOUNCE_US)
+
+        # `tick` son µs de 32 bits (dan la vuelta cada ~72 min). Los convertimos
+        # a la escala de time.monotonic_ns() sumando diferencias de ticks.
+        # NTP corrige CLOCK_MONOTONIC pero no el reloj de pigpio, así que la
+        # suma deriva: si se adelanta a `now` (last_age saldría negativo) o se
+        # queda atrás más de max_lag_ns (deriva, entrega muy tardía o vuelta
+        # ambigua tras una pausa larga), reanclamos en `now`.
+        max_lag_ns = 250_000_000
+        emit = self._emitter()
+        last_tick = None
+        ts = 0
+
+        def cb(gpio, level, tick):
+            nonlocal last_tick, ts
+            now = time.monotonic_ns()
+            if last_tick is not None:
+                ts += ((tick - last_tick) & 0xFFFFFFFF) * 1000
+            if last_tick is None or not 0 <= now - ts <= max_lag_ns:
+                ts = now
+            last_tick = tick
+            emit(ts)
+
+        self._pi = pi
+        self._pi_cb = pi.callback(self.cfg.pin, pigpio.RISING_EDGE, cb)
+
+        if self.cfg.verbose:
+            print(f"[GEIGER] pigpio callback ON GPIO{self.cfg.pin} (RISING)")
+
+    def _start_gpiod(self):
+        from datetime import timedelta
+
+        import gpiod
+        from gpiod.line import Bias, Clock, Direction, Edge
+
+        # Marcas de tiempo del kernel en CLOCK_MONOTONIC: misma escala que
+        # time.monotonic_ns(), sin conversión
+        settings = gpiod.LineSettings(
+            direction=Direction.INPUT,
+            edge_detection=Edge.RISING,
+            bias=Bias.PULL_DOWN,
+            # Un flanco que oscila no cuenta dos veces (como bouncetime en RPi.GPIO)
+            debounce_period=timedelta(microseconds=self.DEBOUNCE_US),
+            event_clock=Clock.MONOTONIC,
+        )
+        request = gpiod.request_lines(
+            self.cfg.gpiochip,
+            consumer="geiger",
+            config={self.cfg.pin: settings},
+            # Margen para varios lotes a tasas altas sin perder eventos
+            event_buffer_size=self.GPIOD_BUFFER,
+        )
+
+        emit = self._emitter()
+        stop = self._stop
+        batch_s = self.GPIOD_BATCH_S
+
+        def run():
+            try:
+                while not stop.is_set():
+                    if request.wait_edge_events(0.5):
+                        for event in request.read_edge_events(self.GPIOD_BUFFER):
+                            emit(event.timestamp_ns)
+                    # Dejamos que el kernel acumule el siguiente lote
+                    stop.wait(batch_s)
+            finally:
+                request.release()
+
+        self._gpiod_thread = threading.Thread(target=run, daemon=True)
+        self._gpiod_thread.start()
+
+        if self.cfg.verbose:
+            print(f"[GEIGER] gpiod edge events ON {self.cfg.gpiochip} line {self.cfg.pin} (RISING)")
+
     def _start_mock(self):
         if self.cfg.verbose:
             print(f"[GEIGER] MOCK ON ~ {self.cfg.mock_rate} pps")
@@ -11,7 +11,7 @@ def main():
     state = GeigerState(cfg)
     reader = GeigerReader(cfg)
 
-    def on_pulse(ts: float):
+    def on_pulse(ts: int):
         state.on_pulse(ts)
         if cfg.verbose:
             print(f"[TEST] total={state.total}")
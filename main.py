@@ -1,13 +1,23 @@
 import os
+import sys
 import asyncio
-from typing import Optional, Set
+import gzip
+import hashlib
+import mimetypes
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
 
+import orjson
 from dotenv import load_dotenv
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, WebSocket, Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+from starlette.websockets import WebSocketState
 
+from broker import RedisBus, acquire_owner_lock
 from geiger import GeigerConfig, GeigerState, GeigerReader
 
 
@@ -17,120 +27,524 @@ cfg = GeigerConfig.from_env()
 state = GeigerState(cfg)
 reader = GeigerReader(cfg)
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles que sirve una variante .br/.gz ya comprimida si el cliente
+    la acepta. Las variantes se generan una vez en el arranque (precompress):
+    ninguna petición comprime nada.
+    """
+
+    COMPRESSIBLE = (".html", ".js", ".css", ".svg", ".json", ".txt")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # ruta original -> [(encoding, ruta comprimida, stat)], br primero
+        self._variants: Dict[str, list] = {}
+
+    def precompress(self):
+        encoders = [("gzip", ".gz", lambda raw: gzip.compress(raw, 9, mtime=0))]
+        if brotli is not None:
+            encoders.insert(0, ("br", ".br", lambda raw: brotli.compress(raw, quality=11)))
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(self.COMPRESSIBLE):
+                    src = os.path.join(root, name)
+                    self._variants[os.path.realpath(src)] = self._compress(src, encoders)
+
+    @staticmethod
+    def _compress(src: str, encoders) -> list:
+        with open(src, "rb") as f:
+            raw = f.read()
+        found = []
+        for encoding, ext, compress in encoders:
+            dst = src + ext
+            try:
+                # Solo se recomprime si el original ha cambiado
+                if not os.path.exists(dst) or os.path.getmtime(dst) < os.path.getmtime(src):
+                    # Fichero temporal + rename: con varios workers arrancando
+                    # a la vez nadie sirve una variante a medio escribir
+                    tmp = f"{dst}.{os.getpid()}.tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(compress(raw))
+                    os.replace(tmp, dst)
+                found.append((encoding, dst, os.stat(dst)))
+            except OSError:
+                # Directorio de solo lectura: se sirve sin comprimir
+                continue
+        return found
+
+    @staticmethod
+    def _accepted(header: str) -> set:
+        """Codificaciones de Accept-Encoding, sin las rechazadas con q=0."""
+        accepted = set()
+        for token in header.split(","):
+            name, *params = (p.strip() for p in token.split(";"))
+            q = 1.0
+            for param in params:
+                if param.startswith("q="):
+                    try:
+                        q = float(param[2:])
+                    except ValueError:
+                        q = 0.0
+            if name and q > 0:
+                accepted.add(name.lower())
+        return accepted
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        variants = self._variants.get(os.path.realpath(full_path))
+        if variants:
+            accepted = self._accepted(Headers(scope=scope).get("accept-encoding", ""))
+            for encoding, path, st in variants:
+                if encoding not in accepted:
+                    continue
+                media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+                response = FileResponse(
+                    path,
+                    status_code=status_code,
+                    stat_result=st,
+                    media_type=media_type,
+                    headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+                )
+                if self.is_not_modified(response.headers, Headers(scope=scope)):
+                    return NotModifiedResponse(response.headers)
+                return response
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if variants:
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
 app = FastAPI(title="Geiger Web (RPi.GPIO backend)")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+static_files = PrecompressedStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")
 templates = Jinja2Templates(directory="templates")
 
 
+def dumps(msg: dict) -> bytes:
+    """JSON con orjson; los arrays de numpy se serializan sin pasar por listas."""
+    return orjson.dumps(msg, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+class WSClient:
+    """Un cliente WS: cola de salida acotada y la tarea que la vacía."""
+    __slots__ = ("ws", "queue", "task", "dropped")
+
+    def __init__(self, ws: WebSocket, maxsize: int):
+        self.ws = ws
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = False
+
+
 class WSManager:
-    def __init__(self):
-        self.clients: Set[WebSocket] = set()
-        self.lock = asyncio.Lock()
+    # Mensajes pendientes por cliente; con la cola llena se descartan
+    QUEUE_SIZE = 128
+    # Segundos que un cliente puede seguir con la cola llena antes de cerrarlo
+    SLOW_TIMEOUT = 5.0
 
-    async def connect(self, ws: WebSocket):
+    def __init__(self):
+        # Copy-on-write: connect/disconnect sustituyen la tupla entera y
+        # broadcast solo lee la referencia actual, sin copias. Todo corre en
+        # el hilo del loop y ninguna sustitución cruza un await: sin lock.
+        # La propia tupla hace de "generación": quien la leyó sigue con una
+        # vista coherente aunque entre medias se conecte o caiga un cliente,
+        # así que no hace falta contador ni reintentar el recorrido.
+        self.clients: Tuple[WSClient, ...] = ()
+        # Clientes con la cola llena -> instante (loop.time()) en que se llenó
+        self._slow: Dict[WSClient, float] = {}
+        # on_recover(client): un cliente que perdió mensajes se ha puesto al
+        # día y necesita de nuevo el estado completo (p. ej. un snapshot)
+        self.on_recover: Optional[Callable[[WSClient], None]] = None
+
+    async def accept(self, ws: WebSocket) -> WSClient:
+        """Handshake y tarea de envío; aún no recibe broadcasts (ver join)."""
         await ws.accept()
-        async with self.lock:
-            self.clients.add(ws)
-
-    async def disconnect(self, ws: WebSocket):
-        async with self.lock:
-            self.clients.discard(ws)
-
-    async def broadcast(self, msg: dict):
-        async with self.lock:
-            clients = list(self.clients)
-        dead = []
-        for ws in clients:
-            try:
-                await ws.send_json(msg)
-            except Exception:
-                dead.append(ws)
-        if dead:
-            async with self.lock:
-                for ws in dead:
-                    self.clients.discard(ws)
+        client = WSClient(ws, self.QUEUE_SIZE)
+        client.task = asyncio.create_task(self._sender(client))
+        return client
+
+    async def connect(self, ws: WebSocket,
+                      first: Optional[Callable[[], bytes]] = None) -> WSClient:
+        """
+        `first()` construye el primer mensaje (ya serializado) después del
+        handshake y sin ningún await hasta registrar al cliente: si entretanto
+        sale un tick, o ya está en `first` o le llega por broadcast.
+        """
+        client = await self.accept(ws)
+        self.join(client, first() if first is not None else None)
+        return client
+
+    def join(self, client: WSClient, first: Optional[bytes] = None):
+        """Empieza a recibir broadcasts; `first` sale antes que ninguno."""
+        if client.dropped:
+            return
+        if first is not None:
+            client.queue.put_nowait(first)
+        self.clients = (*self.clients, client)
+
+    def disconnect(self, client: WSClient):
+        self._drop(client)
+
+    def _drop(self, *dead: WSClient):
+        # Una sola reconstrucción de la tupla para todos los clientes caídos
+        self.clients = tuple(c for c in self.clients if c not in dead)
+        for client in dead:
+            client.dropped = True
+            self._slow.pop(client, None)
+        current = asyncio.current_task()
+        for client in dead:
+            if client.task is not current:
+                client.task.cancel()
+
+    async def _close(self, client: WSClient):
+        try:
+            await client.ws.close()
+        except Exception:
+            pass
+
+    async def _sender(self, client: WSClient):
+        """Único escritor del socket: un cliente lento solo se retrasa a sí mismo."""
+        queue = client.queue
+        try:
+            while True:
+                data = await queue.get()
+                if not queue.empty():
+                    # Va con retraso: todo lo pendiente sale en un solo frame
+                    batch = [data]
+                    while not queue.empty():
+                        batch.append(queue.get_nowait())
+                    data = b"[" + b",".join(batch) + b"]"
+                # Frame binario con el JSON en UTF-8 tal cual sale de orjson:
+                # sin decode() a str ni recodificación al enviar
+                await client.ws.send_bytes(data)
+        except Exception:
+            self._drop(client)
+
+    def broadcast_bytes(self, data: bytes):
+        """
+        Encola `data` (ya serializado una sola vez; todas las colas comparten
+        los mismos bytes) sin esperar a ningún envío. Debe ejecutarse en el
+        hilo del loop: desde otros hilos, vía `loop.call_soon_threadsafe`.
+        """
+        clients = self.clients
+        if not clients:
+            return
+        for client in clients:
+            # Socket ya cerrado (p. ej. caída de WiFi) pendiente de quitar:
+            # se salta con un if en vez de encolar y fallar luego al enviar
+            if client.ws.client_state is not WebSocketState.CONNECTED:
+                continue
+            self._enqueue(client, data)
+
+    def send(self, client: WSClient, data: bytes):
+        """Encola `data` solo para `client`, si sigue conectado. Hilo del loop."""
+        if not client.dropped:
+            self._enqueue(client, data)
+
+    def _enqueue(self, client: WSClient, data: bytes):
+        try:
+            client.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # Cola llena: el mensaje se pierde para este cliente (nunca
+            # bloqueamos ni acumulamos); monitor_slow decide si cerrarlo
+            if client not in self._slow:
+                self._slow[client] = asyncio.get_running_loop().time()
+
+    async def monitor_slow(self):
+        """
+        Cierra los clientes que siguen con la cola llena tras SLOW_TIMEOUT.
+        Los que se ponen al día antes han perdido mensajes (p. ej. ticks):
+        se les pasa a on_recover para que reciban de nuevo el estado completo.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(1.0)
+            if not self._slow:
+                continue
+            now = loop.time()
+            stuck = []
+            for client, since in list(self._slow.items()):
+                if not client.queue.full():
+                    # Se ha puesto al día: vuelve a ser un cliente normal
+                    del self._slow[client]
+                    if self.on_recover is not None:
+                        self.on_recover(client)
+                elif now - since > self.SLOW_TIMEOUT:
+                    stuck.append(client)
+            if stuck:
+                self._drop(*stuck)
+                await asyncio.gather(*(self._close(c) for c in stuck))
+
 
 manager = WSManager()
 MAIN_LOOP: Optional[asyncio.AbstractEventLoop] = None
 
+# Mensaje "snapshot" ya serializado: se codifica una vez por snapshot
+# publicado (uno por tick), no una vez por cada cliente que se conecta
+_snapshot_json: Tuple[Optional[dict], bytes] = (None, b"")
+
+
+def snapshot_json() -> bytes:
+    global _snapshot_json
+    snap = state.snapshot()
+    cached, data = _snapshot_json
+    if cached is not snap:
+        data = dumps({"type": "snapshot", **snap})
+        _snapshot_json = (snap, data)
+    return data
+
+
+# Cuerpo de /api/snapshot y su ETag, también uno por snapshot publicado
+_snapshot_body: Tuple[Optional[dict], bytes, str] = (None, b"", "")
+
+
+def snapshot_body() -> Tuple[bytes, str]:
+    global _snapshot_body
+    snap = state.snapshot()
+    cached, body, etag = _snapshot_body
+    if cached is not snap:
+        body = dumps(snap)
+        etag = make_etag(body)
+        _snapshot_body = (snap, body, etag)
+    return body, etag
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+
+RESET_ACK = dumps({"type": "reset_ack"})
+
+# Con GEIGER_REDIS_URL se pueden usar varios workers: uno solo (el dueño)
+# lee el GPIO y los mensajes se reparten a todos a través de Redis
+REDIS_URL = os.getenv("GEIGER_REDIS_URL")
+OWNER_LOCK = os.getenv("GEIGER_LOCK_FILE", "/tmp/geiger-gpio.lock")
+bus: Optional[RedisBus] = None
+IS_OWNER = True
 
-def schedule_broadcast(msg: dict):
-    global MAIN_LOOP
-    if MAIN_LOOP is None:
-        return
-    try:
-        asyncio.run_coroutine_threadsafe(manager.broadcast(msg), MAIN_LOOP)
-    except Exception:
-        pass
 
+def listening() -> bool:
+    """Hay a quién enviar: clientes locales o, con Redis, otros workers."""
+    return bool(manager.clients) or (bus is not None and bus.up)
 
-def on_pulse(ts: float):
+
+def deliver(data: bytes):
+    """
+    Envía un mensaje serializado a todos los clientes. Hilo del loop.
+    Los clientes propios no dependen de Redis: si cae, siguen recibiendo.
+    """
+    manager.broadcast_bytes(data)
+    if bus is not None and bus.up:
+        bus.publish(data)
+
+
+# Los pulsos se agrupan: como mucho un mensaje "pulses" por ventana
+# (33 ms por defecto, ~30 mensajes/s). deque.append/popleft son seguros
+# entre hilos: el hilo lector solo añade y el loop vacía por temporizador,
+# sin locks ni despertar al loop en cada pulso.
+PULSE_FLUSH_INTERVAL = cfg.pulse_window_ms / 1000
+pulse_queue: Deque[int] = deque(maxlen=GeigerState.PULSE_RING_SIZE)
+
+
+def on_pulse(ts: int):
     state.on_pulse(ts)
-    schedule_broadcast({"type": "pulse", "ts": ts})
+    # Sin nadie conectado no hay a quién avisar: ni encolar ni despertar
+    # al flusher (y un cliente nuevo no recibe pulsos viejos de golpe)
+    if listening():
+        pulse_queue.append(ts)
+
+
+async def pulse_flusher():
+    popleft = pulse_queue.popleft
+    while True:
+        await asyncio.sleep(PULSE_FLUSH_INTERVAL)
+        n = len(pulse_queue)
+        if n:
+            batch = [popleft() for _ in range(n)]
+            deliver(dumps({"type": "pulses", "ts": batch}))
 
 
 @app.get("/", response_class=HTMLResponse)
-def index(request: Request):
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "pin": cfg.pin,
-        "verbose": cfg.verbose,
-        "mock": cfg.mock,
-        "pid": os.getpid(),
-    })
+def index():
+    # Renderizado una sola vez en el arranque (ver on_startup)
+    return HTMLResponse(app.state.index_html)
 
 
-@app.post("/api/reset")
-def api_reset():
+def reset_state():
+    """
+    Hilo del loop, igual que second_loop: entre el reset, el ack y el
+    snapshot no puede colarse ningún tick que el cliente borre y el snapshot
+    no incluya.
+    """
     state.reset()
-    schedule_broadcast({"type": "reset_ack"})
+    if listening():
+        deliver(RESET_ACK)
+        # reset() deja el snapshot en caché: se serializa una vez y se
+        # reutiliza para el broadcast y para los clientes que conecten después
+        deliver(snapshot_json())
+
+
+def resync(client: WSClient):
+    """
+    Un cliente que perdió mensajes por ir lento recibe de nuevo el snapshot
+    completo: el navegador lo toma como reemplazo de la serie entera.
+    """
+    if IS_OWNER:
+        manager.send(client, snapshot_json())
+    else:
+        bus.on_next_snapshot(lambda data: manager.send(client, data))
+
+
+manager.on_recover = resync
+
+
+def on_control(cmd: bytes):
+    """Órdenes de los demás workers por Redis (solo en el dueño, hilo del loop)."""
+    if cmd == b"reset":
+        reset_state()
+    elif cmd == b"snapshot":
+        # Sale por el mismo publicador que los ticks: llega en orden con ellos
+        bus.publish_snapshot(snapshot_json())
+
+
+@app.post("/api/reset")
+async def api_reset():
+    # async: corre en el hilo del loop, no en el threadpool (ver reset_state)
+    if IS_OWNER:
+        reset_state()
+    else:
+        # El estado vive en el worker que lee el GPIO: se lo pedimos por Redis
+        bus.request_reset()
     if cfg.verbose:
         print("[APP] RESET via API")
     return JSONResponse({"ok": True})
 
 
 @app.get("/api/snapshot")
-def api_snapshot():
-    return JSONResponse(state.snapshot())
+def api_snapshot(request: Request):
+    if IS_OWNER:
+        body, etag = snapshot_body()
+    else:
+        # Lo pedimos al dueño; el mensaje WS lleva además "type"
+        future = asyncio.run_coroutine_threadsafe(bus.snapshot(), MAIN_LOOP)
+        data = future.result(timeout=5)
+        if data is None:
+            return JSONResponse({"ok": False, "error": "no snapshot"}, status_code=503)
+        snap = orjson.loads(data)
+        snap.pop("type", None)
+        body = orjson.dumps(snap)
+        etag = make_etag(body)
+    # Quien sondea más rápido que el tick recibe un 304 sin cuerpo
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    match = request.headers.get("if-none-match")
+    if match and etag in (m.strip() for m in match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 @app.websocket("/ws")
 async def ws_endpoint(ws: WebSocket):
-    await manager.connect(ws)
+    if IS_OWNER:
+        client = await manager.connect(ws, first=snapshot_json)
+    else:
+        # Entra en la difusión justo cuando llega el snapshot del dueño, en
+        # orden con los ticks: ni huecos ni ticks repetidos
+        client = await manager.accept(ws)
+        bus.on_next_snapshot(lambda data: manager.join(client, data))
     try:
-        await ws.send_json({"type": "snapshot", **state.snapshot()})
+        # Esperamos sobre el propio socket: el cierre se detecta al instante.
+        # El cliente no envía nada; cualquier mensaje (texto o binario) se
+        # descarta.
         while True:
-            await asyncio.sleep(3600)
-    except WebSocketDisconnect:
-        pass
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                break
     finally:
-        await manager.disconnect(ws)
+        manager.disconnect(client)
 
 
 async def second_loop():
     while True:
         await asyncio.sleep(1.0)
-        state.tick_second()
-        await manager.broadcast({"type": "snapshot", **state.snapshot()})
+        # Sin clientes solo se cierra el bin: ni histograma ni snapshot
+        tick = state.tick_second(publish=listening())
+        if tick is None:
+            continue
+        # Snapshot completo solo al conectar/reset; cada segundo, solo lo nuevo
+        deliver(dumps({"type": "tick", **tick}))
 
 
 @app.on_event("startup")
 async def on_startup():
-    global MAIN_LOOP
+    global MAIN_LOOP, bus, IS_OWNER
     MAIN_LOOP = asyncio.get_running_loop()
 
+    static_files.precompress()
+
+    # Los datos de la plantilla no cambian en toda la vida del proceso
+    app.state.index_html = templates.get_template("index.html").render(
+        pin=cfg.pin,
+        verbose=cfg.verbose,
+        mock=cfg.mock,
+        pid=os.getpid(),
+    )
+
     if cfg.verbose:
         print(f"[APP] startup pid={os.getpid()} GPIO{cfg.pin} mock={cfg.mock}")
+        print(f"[APP] event loop: {type(MAIN_LOOP).__module__}.{type(MAIN_LOOP).__name__}")
+
+    if REDIS_URL:
+        # Solo un worker puede abrir el GPIO: el que se queda el lock
+        IS_OWNER = acquire_owner_lock(OWNER_LOCK)
+        bus = RedisBus(REDIS_URL)
+        if IS_OWNER:
+            bus.start(on_control=on_control, snapshot=snapshot_json)
+        else:
+            bus.start(on_message=manager.broadcast_bytes)
+        if cfg.verbose:
+            print(f"[APP] redis bus {'owner (GPIO)' if IS_OWNER else 'relay'}")
+
+    asyncio.create_task(manager.monitor_slow())
+    if not IS_OWNER:
+        return
 
     reader.set_callback(on_pulse)
     reader.start()
 
+    if cfg.verbose:
+        # Tras arrancar el lector: importar RPi.GPIO puede reactivar el GIL
+        gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+        print(f"[APP] GIL {'enabled' if gil else 'disabled (free-threaded)'}")
+
     asyncio.create_task(second_loop())
+    asyncio.create_task(pulse_flusher())
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
     reader.stop()
+    if bus is not None:
+        await bus.close()
     if cfg.verbose:
         print("[APP] shutdown")
 
+
+if __name__ == "__main__":
+    # `python main.py` equivale al comando de uvicorn del README
+    import importlib.util
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host=os.getenv("GEIGER_HOST", "0.0.0.0"),
+        port=int(os.getenv("GEIGER_PORT", "8000")),
+        workers=1,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        ws_per_message_deflate=False,
+    )
@@ -82,6 +82,9 @@ function updateCaption(rate, err){
   cap.innerHTML = `Actividad efectiva observada: <b>${r}</b> ± <b>${e}</b> Bq`;
 }
 
+// Tamaño de la ventana (el servidor lo manda en cada snapshot)
+let maxSeries = 3600;
+
 function updateTimeChart(perSecond, runningMean){
   const n = perSecond.length;
   const labels = Array.from({length:n}, (_, i)=> i+1);
@@ -91,34 +94,44 @@ function updateTimeChart(perSecond, runningMean){
   timeChart.update();
 }
 
-function updateDtHistogram(deltas){
-  if(!deltas || deltas.length < 2){
-    dtChart.data.labels = [];
-    dtChart.data.datasets[0].data = [];
-    dtChart.update();
-    return;
+function appendTimePoint(cps, mean){
+  const labels = timeChart.data.labels;
+  const perSecond = timeChart.data.datasets[0].data;
+  const runningMean = timeChart.data.datasets[1].data;
+
+  labels.push(labels.length ? labels[labels.length - 1] + 1 : 1);
+  perSecond.push(cps);
+  runningMean.push(mean);
+  if(perSecond.length > maxSeries){
+    labels.shift();
+    perSecond.shift();
+    runningMean.shift();
   }
+  timeChart.update();
+}
+
+function updateMetrics(msg){
+  document.getElementById("totalCount").textContent = msg.total ?? 0;
+  document.getElementById("elapsedSec").textContent = Math.floor(msg.elapsed ?? 0);
 
-  const maxDt = Math.max(...deltas);
-  const cap = Math.max(1.5, Math.min(10.0, maxDt));
-  const filtered = deltas.filter(d => d >= 0 && d <= cap);
-
-  const bins = 24;
-  const lo = 0.0;
-  const hi = cap;
-  const w = (hi - lo) / bins;
-
-  const counts = new Array(bins).fill(0);
-  for(const d of filtered){
-    let idx = Math.floor((d - lo) / w);
-    if(idx < 0) idx = 0;
-    if(idx >= bins) idx = bins - 1;
-    counts[idx] += 1;
+  if(msg.last_age == null){
+    document.getElementById("lastAge").textContent = "—";
+  }else{
+    document.getElementById("lastAge").textContent =
+      (msg.last_age).toFixed(2);
   }
 
+  updateCaption(msg.rate_bq ?? 0, msg.rate_err ?? 0);
+}
+
+function updateDtHistogram(hist){
+  // El servidor manda el histograma ya calculado: {edges, counts}
+  const edges = hist?.edges ?? [];
+  const counts = hist?.counts ?? [];
+
   const labels = counts.map((_, i)=>{
-    const a = (lo + i*w).toFixed(2);
-    const b = (lo + (i+1)*w).toFixed(2);
+    const a = edges[i].toFixed(2);
+    const b = edges[i+1].toFixed(2);
     return `${a}-${b}s`;
   });
 
@@ -154,11 +167,13 @@ document.getElementById("resetBtn").addEventListener("click", async ()=>{
 // ---------------------------
 const wsProto = location.protocol === "https:" ? "wss" : "ws";
 const ws = new WebSocket(`${wsProto}://${location.host}/ws`);
+// El servidor envía el JSON en frames binarios (UTF-8)
+ws.binaryType = "arraybuffer";
+const wsDecoder = new TextDecoder();
 
-ws.onmessage = (ev)=>{
-  const msg = JSON.parse(ev.data);
-
-  if(msg.type === "pulse"){
+function handleMessage(msg){
+  if(msg.type === "pulses"){
+    // un lote de pulsos (agrupados en el servidor)
     blink();
     beep();
     return;
@@ -169,29 +184,40 @@ ws.onmessage = (ev)=>{
     document.getElementById("elapsedSec").textContent = 0;
     document.getElementById("lastAge").textContent = "—";
     updateTimeChart([], []);
-    updateDtHistogram([]);
+    updateDtHistogram(null);
     updateCaption(0, 0);
     updateDebug(msg);
     return;
   }
 
   if(msg.type === "snapshot"){
-    document.getElementById("totalCount").textContent = msg.total ?? 0;
-    document.getElementById("elapsedSec").textContent = Math.floor(msg.elapsed ?? 0);
-
-    if(msg.last_age == null){
-      document.getElementById("lastAge").textContent = "—";
-    }else{
-      document.getElementById("lastAge").textContent =
-        (msg.last_age).toFixed(2);
-    }
+    maxSeries = msg.max_series ?? maxSeries;
 
+    updateMetrics(msg);
     updateTimeChart(msg.per_second ?? [], msg.running_mean ?? []);
-    updateDtHistogram(msg.deltas ?? []);
-    updateCaption(msg.rate_bq ?? 0, msg.rate_err ?? 0);
+    updateDtHistogram(msg.dt_hist);
+
+    updateDebug(msg);
+    return;
+  }
+
+  if(msg.type === "tick"){
+    updateMetrics(msg);
+    appendTimePoint(msg.cps ?? 0, msg.running_mean ?? 0);
+    // Sin pulsos nuevos el servidor omite el histograma: se mantiene el último
+    if(msg.dt_hist) updateDtHistogram(msg.dt_hist);
 
     updateDebug(msg);
   }
+}
+
+ws.onmessage = (ev)=>{
+  // Si el cliente va con retraso, el servidor junta varios mensajes en un array
+  const raw = typeof ev.data === "string" ? ev.data : wsDecoder.decode(ev.data);
+  const data = JSON.parse(raw);
+  for(const msg of (Array.isArray(data) ? data : [data])){
+    handleMessage(msg);
+  }
 };
 
 ws.onopen  = ()=>console.log("WS conectado");